@@ -1,84 +1,165 @@
 import re
+import functools
+import importlib.util
 import pandas as pd
 import numpy as np
+import xlsxwriter
 from io import BytesIO
 import streamlit as st
 
+# 🔹 Regex patterns used on every upload, compiled once when the app starts 🔹
+NON_NUMERIC_RE   = re.compile(r"[^\d.\-]+")  # 🔹 every run of characters other than digits, decimal points, and minus signs
+BB_EQUITY_RE     = re.compile(r"\s*Equity\s*", re.IGNORECASE)   # 🔹 the word "Equity" with the spaces around it
+
+# 🔹 Single-character fixes done with str.translate tables instead of the regex engine: characters to delete from number cells, and the hard space in tickers 🔹
+PERCENT_COMMA_TABLE = str.maketrans("", "", "%,")
+COMMA_TABLE         = str.maketrans("", "", ",")
+NBSP_TABLE          = str.maketrans({"\u00A0": " "})   # 🔹 hard space (\u00A0) → normal space
+
+# 🔹 Excel reader: the Rust-based "calamine" engine when python-calamine is installed (several times faster on large workbooks), otherwise pandas' default openpyxl 🔹
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
+
+# 🔹 xlsxwriter settings for the downloadable reports: rows are streamed out as they are written instead of keeping the whole workbook in memory (constant_memory), and text cells are written as plain text, without checking every cell for a web link or a leading "=" formula 🔹
+XLSX_OPTIONS = {"constant_memory": True, "strings_to_urls": False, "strings_to_formulas": False}
+
 # 🔹 Helper Functions 🔹
 # 🔹 This function removes duplicate column names in a table — and keeps only the first copy of each name. 🔹
 # 🔹 This function is helpful when your Excel file has multiple sheets and some of them have columns with the same name repeated. It cleans that up by keeping just one version of each column name. 🔹
 def ensure_unique_columns(df):
     return df.loc[:, ~df.columns.duplicated()].copy()
     
-# 🔹 If your Excel sheet uses two rows for column names (Multindex columns), this function joins them into one clean name so your table is easier to use 🔹    
-def flatten_multilevel_columns(df):
-    df.columns = [
-        " ".join(str(l).strip() for l in col).strip()
-        for col in df.columns
-    ]
+# 🔹 If your Excel sheet uses two rows for column names (Multindex columns), this function joins them into one clean name and drops every "Parent Company" column while going over the headers once. Works on a new table, so the one passed in keeps its columns 🔹
+def flatten_and_drop_parent_columns(df):
+    names = [" ".join(str(l).strip() for l in col).strip() for col in df.columns]
+    keep = np.array([not name.lower().startswith("parent company") for name in names], dtype=bool)
+    df = df.iloc[:, np.flatnonzero(keep)]
+    df.columns = [name for name, k in zip(names, keep) if k]
+    return df
+
+# 🔹 True when a column already holds real numbers (Excel number cells), so it does not need the text cleaning. True/False columns are not counted as numbers. 🔹
+def is_number_column(s):
+    return pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s)
+
+# 🔹 True for every cell that says "yes" (any upper/lower case). Each cell is looked at once; numbers and blanks are never a "yes" 🔹
+def is_yes(s):
+    return np.fromiter(
+        (isinstance(v, str) and v.lower() == "yes" for v in s.to_numpy(dtype=object)),
+        dtype=bool, count=len(s)
+    )
+
+# 🔹 Builds the exclusion reason for every company from a True/False table (companies × rules): the labels of the rules a company breaks, joined with "; ". Each company's row is packed into one number (rule 1 → 1, rule 2 → 2, rule 3 → 4, ...), so the text is built once per distinct combination instead of once per company. 🔹
+def build_reasons(mask, labels):
+    mask = np.asarray(mask, dtype=bool)
+    codes = mask.astype(np.int64) @ (1 << np.arange(len(labels), dtype=np.int64))
+    uniq, inverse = np.unique(codes, return_inverse=True)
+    texts = np.array([
+        "; ".join(label for j, label in enumerate(labels) if code >> j & 1)
+        for code in uniq
+    ], dtype=object)
+    return texts[inverse.ravel()]
+
+# 🔹 Turns a group of columns into numbers in one go: removes the characters matched by "pattern" (a compiled regex, or a str.maketrans table of characters to delete) from every text cell as one block, converts the whole block to numbers with a single pd.to_numeric call (flattened, then shaped back into columns), and puts 0 where a value is missing or unreadable. Columns that Excel already delivered as numbers skip the text cleaning and only get their blanks set to 0, but only when "pattern" is a str.maketrans table: taking "%" or "," out of a number written as text gives back the same number, while a regex like NON_NUMERIC_RE also strips the "e" of 4e-05 or 2e16, so with a regex every column goes through the text cleaning as before. 🔹
+def clean_numeric_columns(df, cols, pattern):
+    skip_numbers = isinstance(pattern, dict)
+    text_cols = [c for c in cols if not (skip_numbers and is_number_column(df[c]))]
+    number_cols = [c for c in cols if c not in text_cols]
+    if number_cols:
+        df[number_cols] = df[number_cols].fillna(0)
+    if text_cols:
+        text = df[text_cols].astype(str)
+        if isinstance(pattern, dict):
+            cleaned = np.frompyfunc(lambda v: v.translate(pattern), 1, 1)(text.to_numpy())
+        else:
+            cleaned = text.replace(pattern, "", regex=True).to_numpy()
+        numbers = pd.to_numeric(cleaned.ravel(), errors="coerce").reshape(cleaned.shape)
+        df[text_cols] = pd.DataFrame(numbers, index=df.index, columns=text_cols).fillna(0)
     return df
 
+# 🔹 Cleans up one column name (or search word): removes spaces and breaks at the ends, makes it lowercase, and replaces line-breaks and multiple spaces with just one space. Results are remembered, since the same headers and search words come back on every sheet and every upload 🔹
+@functools.lru_cache(maxsize=4096)
+def normalize_header(text):
+    return " ".join(text.lower().split())
+
+# 🔹 Compiles a search pattern once and remembers it, so the same column searches on every upload reuse the compiled version 🔹
+@functools.lru_cache(maxsize=512)
+def compile_pattern(pattern, flags=0):
+    return re.compile(pattern, flags)
+
 # 🔹Searches column headers using any of three modes: exact (must match exactly), partial (look for the pattern inside column names), regex (use advanced matching (like wildcards)). Normalises spaces, case, and line-breaks before matching. Raises ValueError when nothing found 🔹 
-def find_column(df, patterns, how="partial", required=True):
-    # 🔹 This creates a cleaned-up version of all the column names in the table by removing spaces and breaks, making everything in lowercase, and replacing multiple spaces with just one 🔹
-    norm_map = {
-        col: re.sub(r"\s+", " ", col.strip().lower().replace("\n", " "))
-        for col in df.columns
-    }
+def find_column(df, patterns, how="partial", required=True, norm_map=None):
+    # 🔹 This creates a cleaned-up version of all the column names in the table by removing spaces and breaks, making everything in lowercase, and replacing multiple spaces with just one. Callers that look up many columns can pass it in ready-made ("norm_map") 🔹
+    if norm_map is None:
+        norm_map = {col: normalize_header(col) for col in df.columns}
      # 🔹 This does the same cleanup for the words you're looking for. 🔹
-    pats = [
-        re.sub(r"\s+", " ", p.strip().lower().replace("\n", " "))
-        for p in patterns
-    ]
+    pats = [normalize_header(p) for p in patterns]
     # 🔹 If any cleaned column name matches the cleaned pattern, return that column name. 🔹
-    # exact
+    # exact — reverse lookup {cleaned name: column}, the first column wins on duplicates
+    exact = {}
+    for col, norm in norm_map.items():
+        exact.setdefault(norm, col)
     for pat in pats:
-        for col, norm in norm_map.items():
-            if norm == pat:
-                return col
-    # partial
+        if pat in exact:
+            return exact[pat]
+    # partial — all patterns joined into one "a|b|c" search, so each column name is scanned once
     if how == "partial":
+        any_pat = compile_pattern("|".join(re.escape(pat) for pat in pats))
         for col, norm in norm_map.items():
-            for pat in pats:
-                if pat in norm:
-                    return col
-    # regex
+            if any_pat.search(norm):
+                return col
+    # regex — each pattern is compiled once per process (compile_pattern), not once per column
     if how == "regex":
         for pattern in patterns:
+            rx = compile_pattern(pattern, re.IGNORECASE)
             for col in df.columns:
-                if re.search(pattern, col, flags=re.IGNORECASE):
+                if rx.search(col):
                     return col
     if required:
         raise ValueError(f"Could not find a required column among {patterns}\nAvailable: {list(df.columns)}")
     return None
 
 # 🔹 It renames column headers in your table so that they all follow a clean, standard name — even if the original names in the Excel file are messy or inconsistent. Takes names from "rename_map" table (presented later in the code) 🔹 
+# 🔹 The cleaned-up column names are built once for the whole rename_map and only the renamed entry is refreshed after each rename 🔹
 def rename_columns(df, rename_map):
+    norm_map = {col: normalize_header(col) for col in df.columns}
     for new, pats in rename_map.items():
-        old = find_column(df, pats, how="partial", required=False)
+        old = find_column(df, pats, how="partial", required=False, norm_map=norm_map)
         if old and old != new:
             df.rename(columns={old: new}, inplace=True)
+            new_norm = normalize_header(new)
+            norm_map = {
+                (new if col == old else col): (new_norm if col == old else norm)
+                for col, norm in norm_map.items()
+            }
     return df
 
-# 🔹 Removes hard-space (\u00A0) characters. Strips any case-insensitive " Equity" suffix. Returns a copy so original df is untouched.🔹 
-def remove_equity_from_bb_ticker(df):
-    df = df.copy()
+# 🔹 Removes hard-space (\u00A0) characters. Strips any case-insensitive " Equity" suffix. Returns a copy so original df is untouched, unless inplace=True — then only the "BB Ticker" column of df itself is replaced.🔹 
+def remove_equity_from_bb_ticker(df, inplace=False):
+    if not inplace:
+        df = df.copy()
     if "BB Ticker" in df.columns:
         df["BB Ticker"] = (
             df["BB Ticker"]
               .astype(str)
-              .str.replace(r"\u00A0", " ", regex=True)
-              .str.replace(r"(?i)\s*Equity\s*", "", regex=True)
+              .str.translate(NBSP_TABLE)
+              .str.replace(BB_EQUITY_RE, "", regex=True)
               .str.strip()
         )
     return df
 
+# 🔹 Reads one sheet of the uploaded workbook (two header rows: rows 4 and 5 in Excel). Streamlit caches the result by file content, so clicking a button again or changing a setting does not parse the same Excel file again. Only the sheets of the last few uploads are kept, each for at most an hour, so old files do not pile up in the server's memory. 🔹
+@st.cache_data(show_spinner=False, max_entries=16, ttl=3600)
+def load_sheet(file_bytes, sheet):
+    return pd.read_excel(BytesIO(file_bytes), sheet, header=[3, 4], engine=EXCEL_ENGINE)
+
 # 🔹🔹🔹 Level 1 Exclusion 🔹🔹🔹
-# 🔹 It opens an Excel file, reads a sheet called “All Companies”, cleans up the column names, and removes any company listed as a “Parent Company". 🔹
+# 🔹 It takes the uploaded Excel file (as bytes), reads the sheet called “All Companies” through the cached "load_sheet", cleans up the column names, and removes any company listed as a “Parent Company". 🔹
 # 🔹 Reads data from rows 4 and 5 (0-indexed) from a two-level column index. It is needed as a column name located not in the first row. Data clearingand ignores "parent company" column🔹
-def filter_companies_by_revenue(uploaded_file, sector_exclusions, total_thresholds):
-    xls = pd.ExcelFile(uploaded_file)
-    df = xls.parse("All Companies", header=[3,4])
+# 🔹 Streamlit remembers the result per uploaded file and Level 1 settings, so "Run Level 2" reuses the Level 1 run instead of filtering again when nothing changed (each caller gets its own copy of the tables). 🔹
+@st.cache_data(show_spinner=False, max_entries=8)
+def filter_companies_by_revenue(file_bytes, sector_exclusions, total_thresholds):
+    df = load_sheet(file_bytes, "All Companies")
+    # 🔹 Keeps the original company names (7th column of the sheet) for the name repair at the end, so the sheet does not have to be loaded a second time 🔹
+    raw_company = df.iloc[:, 6].fillna("").astype(str)
     df.columns = [" ".join(map(str,c)).strip() for c in df.columns]
     df = df.loc[:, ~df.columns.str.lower().str.startswith("parent company")]
     df = remove_equity_from_bb_ticker(df)
@@ -108,94 +189,96 @@ def filter_companies_by_revenue(uploaded_file, sector_exclusions, total_threshol
 
     # 🔹 It checks which companies are completely missing revenue data, and separates them from the rest. Checks for revenue data to ignore columns with company names and tickers🔹
     revenue_cols = needed[4:]
-    no_data = df[df[revenue_cols].isnull().all(axis=1)].copy()
-    df = df.dropna(subset=revenue_cols, how="all")
+    # 🔹 One NumPy reduction over the revenue block (no intermediate True/False table) 🔹
+    no_data_mask = pd.isna(df[revenue_cols].to_numpy()).all(axis=1)
+    no_data = df[no_data_mask].copy()
+    df = df[~no_data_mask]
  
     # 🔹 European comma → US dot, percent sign removed, cast to float data, and corrupt values cleaning 🔹
-    for c in revenue_cols:
-        df[c] = (
-            df[c]
-              .astype(str)
-              .str.replace("%","",regex=True)
-              .str.replace(",","",regex=True)
-        )
-        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
+    # 🔹 All revenue columns are cleaned as one block and written back in a single assignment (one pass removes both "%" and ",") 🔹
+    df = clean_numeric_columns(df, revenue_cols, PERCENT_COMMA_TABLE)
    
     # 🔹 This part adds up revenue columns for each company, based on what the user selected in Streamlit (Custom Totals). 🔹
-    # 🔹 Line 2 (which is "secs = ...") builds a list of valid sector columns from the user's selection 🔹
-    # 🔹 Line 3 creates a new column in the table named after key, like "Custom Total 1".🔹 🔹
-    for key,info in total_thresholds.items():
-        secs = [s for s in info["sectors"] if s in df.columns]
-        df[key] = df[secs].sum(axis=1) if secs else 0.0
+    # 🔹 "weights" is a 0/1 table (revenue column × custom total) marking which sectors the user selected for each total; one matrix multiplication then gives every total for every company at once. 🔹
+    # 🔹 Each total becomes a new column in the table named after key, like "Custom Total 1". A total with no sectors selected is 0.🔹
+    # 🔹 Rows holding an infinite value (a cell that said "inf") are left out of the multiplication and added up only over the selected sectors instead, because inf × 0 would turn every total of that row into NaN. 🔹
+    if total_thresholds:
+        weights = np.array(
+            [[s in info["sectors"] for info in total_thresholds.values()] for s in revenue_cols],
+            dtype=np.float64
+        )
+        values = df[revenue_cols].to_numpy(dtype=np.float64)
+        inf_rows = np.isinf(values).any(axis=1)
+        totals = np.empty((len(values), len(total_thresholds)))
+        totals[~inf_rows] = values[~inf_rows] @ weights
+        totals[inf_rows] = np.where(weights > 0, values[inf_rows][:, :, None], 0.0).sum(axis=1)
+        df[list(total_thresholds)] = totals
         
-    # 🔹 This checks each company, one by one, to see if it should be excluded based on user-defined sector thresholds🔹
-    # 🔹 A bit of explanation of the code: in the for loop, "r" represents one row (one company), "_" is just a throwaway variable for the row index (it means the code would ignore the index and use only the row's content)🔹
-    # 🔹 We create an empty list called "parts" to store all the reasons that apply to this one company. "sector" might be something like "Fracking Revenue", "flag" is True or False (whether the user checked the box to exclude), "thr" is the threshold string the user typed (like "10")
-    reasons = []
-    for _,r in df.iterrows():
-        parts = []
-        for sector,(flag,thr) in sector_exclusions.items():
-            if flag and thr.strip():
-                try:
-                    if r[sector] > float(thr)/100:
-                        parts.append(f"{sector} > {thr}%")
-                except:
-                    pass
-    
+    # 🔹 This collects every active rule once: (column, threshold as a fraction, reason text). "sector" might be something like "Fracking Revenue", "flag" is True or False (whether the user checked the box to exclude), "thr" is the threshold string the user typed (like "10"). Thresholds that are not numbers are ignored.🔹
+    active = []
+    for sector,(flag,thr) in sector_exclusions.items():
+        if flag and thr.strip():
+            try:
+                active.append((sector, float(thr)/100, f"{sector} > {thr}%"))
+            except ValueError:
+                pass
+
     # 🔹 It checks whether the company exceeds any custom total threshold (like “Custom Total 1 > 15%”), and if so, adds a reason explaining that.🔹
     # 🔹 A bit of details on how the "info" dictionary works: info = { "sectors": ["Fracking Revenue", "Arctic Revenue"], "threshold": "10"}. The "section" part is a combination of sectors selected by the user in Custom Total, and the "threshold" is a value set by the user.
-        for key,info in total_thresholds.items():
-            t = info.get("threshold","").strip()
-            if t:
-                try:
-                    if r[key] > float(t)/100:
-                        parts.append(f"{key} > {t}%")
-                except:
-                    pass
-        reasons.append("; ".join(parts))
+    for key,info in total_thresholds.items():
+        t = info.get("threshold","").strip()
+        if t:
+            try:
+                active.append((key, float(t)/100, f"{key} > {t}%"))
+            except ValueError:
+                pass
+
+    # 🔹 All companies are checked at once: one matrix comparison (companies × rules) against the thresholds, turned into reason text by "build_reasons". 🔹
+    reasons = np.full(len(df), "", dtype=object)
+    if active:
+        values = df[[col for col,_,_ in active]].to_numpy(dtype=np.float64)
+        mask = values > np.array([thr for _,thr,_ in active])
+        reasons = build_reasons(mask, [label for _,_,label in active])
     df["Exclusion Reason"] = reasons
    
-    # 🔹 It splits the companies into two groups: Retained and Excluded 🔹
-    excluded = df[df["Exclusion Reason"]!=""].copy()
-    retained = df[df["Exclusion Reason"]==""].copy()
+    # 🔹 It splits the companies into two groups: Retained and Excluded. The reason column is compared once and both groups are taken by row position. 🔹
+    is_excl = reasons != ""
+    excluded = df.iloc[np.flatnonzero(is_excl)].copy()
+    retained = df.iloc[np.flatnonzero(~is_excl)].copy()
 
     # 🔹 If there's only one custom total (called "Custom Total 1"), it renames that column to a friendlier name: "Custom Total Revenue"🔹
     if "Custom Total 1" in df.columns:
         for d in (excluded, retained, no_data):
             d.rename(columns={"Custom Total 1":"Custom Total Revenue"}, inplace=True)
   
-    # 🔹 This section repairs company names in the final output. It fixes cases where the name is missing or is just a "." Any blank values in the "Company" column are replaced with empty text "". Ensures all entries are strings (text), even if they were originally numbers or empty.🔹
-    # 🔹 Makes sure the column headers are turned into simple strings (in case it's a multi-level header like before).🔹
-    # 🔹 Removes the column if its name starts with "parent company" — just being safe. 🔹
-    # 🔹 Wherever a company name is missing (even if it was "."), we fill it in using the clean names from the original Excel sheet (raw["Company"]). 🔹
-    raw = xls.parse("All Companies", header=[3,4]).iloc[:,[6]]
-    raw = flatten_multilevel_columns(raw)
-    raw = raw.loc[:, ~raw.columns.str.lower().str.startswith("parent company")]
-    raw.columns = ["Company"]
-    raw["Company"] = raw["Company"].fillna("").astype(str)
+    # 🔹 This section repairs company names in the final output. It fixes cases where the name is missing or is just a "." Any blank values in the original names are replaced with empty text "". Ensures all entries are strings (text), even if they were originally numbers or empty.🔹
+    # 🔹 Wherever a company name is missing (even if it was "."), we fill it in using the clean names kept from the original Excel sheet ("raw_company"), matched by row number within each renumbered table. Only the missing names are looked up, with one True/False mask per table. 🔹
+    raw_names = raw_company.to_numpy()
     for d in (excluded, retained, no_data):
         d.reset_index(drop=True, inplace=True)
-        d["Company"] = d["Company"].replace(".", np.nan)
-        d["Company"].fillna(raw["Company"], inplace=True)
+        names = d["Company"].to_numpy(dtype=object, copy=True)
+        missing = pd.isna(names) | (names == ".")
+        names[missing] = raw_names[np.flatnonzero(missing)]
+        d["Company"] = names
 
     return excluded, retained, no_data
 
 # 🔹🔹🔹 Level-2 — Upstream filter 🔹🔹🔹
 # 🔹 It prepares the "Upstream" sheet of the Excel file by flattening the column names and Removing any columns that start with "Parent Company"🔹
 def filter_upstream_companies(df):
-    df = flatten_multilevel_columns(df)
-    df = df.loc[:, ~df.columns.str.lower().str.startswith("parent company")]
+    df = flatten_and_drop_parent_columns(df)
 
-    # 🔹 This finds and stores the correct column names from the Excel sheet, even if they don’t match exactly. Type of searching can be adjusted in "how =" 🔹
-    comp_col      = find_column(df, ["company"], how="partial", required=True)
+    # 🔹 This finds and stores the correct column names from the Excel sheet, even if they don’t match exactly. Type of searching can be adjusted in "how =". The cleaned-up column names are built once and shared by all five searches 🔹
+    norm_map = {col: normalize_header(col) for col in df.columns}
+    comp_col      = find_column(df, ["company"], how="partial", required=True, norm_map=norm_map)
     res_col       = find_column(df, ["resources under development and field evaluation"],
-                                how="partial", required=True)
+                                how="partial", required=True, norm_map=norm_map)
     capex_avg_col = find_column(df, ["exploration capex 3-year average"],
-                                how="partial", required=True)
+                                how="partial", required=True, norm_map=norm_map)
     short_col     = find_column(df, ["short-term expansion ≥20 mmboe"],
-                                how="partial", required=True)
+                                how="partial", required=True, norm_map=norm_map)
     capex10_col   = find_column(df, ["exploration capex ≥10 musd"],
-                                how="partial", required=True)
+                                how="partial", required=True, norm_map=norm_map)
 
     # 🔹 It renames the columns in the DataFrame to a standard set of names, no matter what the original Excel file called them. 🔹
     df = df.rename(columns={
@@ -211,53 +294,79 @@ def filter_upstream_companies(df):
         "Resources under Development and Field Evaluation",
         "Exploration CAPEX 3-year average",
     ]
-    for c in num_cols:
-        df[c] = pd.to_numeric(
-            df[c].astype(str)               # 🔹 Ensures even numeric or null cells are treated as strings.
-                 .str.replace(",", "", regex=True)   # 🔹 Removes commas
-                 .str.replace(r"[^\d.\-]", "", regex=True),   # 🔹 Removes everything except digits, decimal points, and minus signs.
-            errors="coerce"
-        ).fillna(0)
+    # 🔹 Removes everything except digits, decimal points, and minus signs (commas included) in one pass over both columns. 🔹
+    df = clean_numeric_columns(df, num_cols, NON_NUMERIC_RE)
 
 
     # 🔹 Checks whether the company has any resources under development, invested any CAPEX over the past 3 years, short-term expansion exceeds 20 MMBOE, larger exploration projects with CAPEX ≥ $10 million, Exclude if any condition is true 🔹
-    df["F2_Res"] = df["Resources under Development and Field Evaluation"] > 0
-    df["F2_Avg"] = df["Exploration CAPEX 3-year average"] > 0
-    df["F2_ST"]  = df["Short-Term Expansion ≥20 mmboe"].astype(str).str.lower().eq("yes")
-    df["F2_10M"] = df["Exploration CAPEX ≥10 MUSD"].astype(str).str.lower().eq("yes")
-    df["Excluded"] = df[["F2_Res","F2_Avg","F2_ST","F2_10M"]].any(axis=1)
-
-    # 🔹 For each company (row), it builds a text summary of the reasons why that company was excluded — based on which conditions were true.🔹
-    df["Exclusion Reason"] = df.apply(
-        lambda r: "; ".join(p for p in (
-            "Resources under development and field evaluation > 0" if r["F2_Res"] else None,
-            "3-yr CAPEX avg > 0" if r["F2_Avg"] else None,
-            "Short-Term Expansion = Yes"   if r["F2_ST"]  else None,
-            "CAPEX ≥10 MUSD = Yes"         if r["F2_10M"] else None,
-        ) if p),
-        axis=1
-    )
+    # 🔹 The four checks are kept as one True/False table (companies × checks) instead of four extra columns in the sheet 🔹
+    flags = np.column_stack([
+        df["Resources under Development and Field Evaluation"].to_numpy() > 0,
+        df["Exploration CAPEX 3-year average"].to_numpy() > 0,
+        is_yes(df["Short-Term Expansion ≥20 mmboe"]),
+        is_yes(df["Exploration CAPEX ≥10 MUSD"]),
+    ])
+    is_excl = flags.any(axis=1)
+
+    # 🔹 For each company (row), it builds a text summary of the reasons why that company was excluded — based on which conditions were true (same "build_reasons" helper as Level 1).🔹
+    df["Exclusion Reason"] = build_reasons(flags, [
+        "Resources under development and field evaluation > 0",
+        "3-yr CAPEX avg > 0",
+        "Short-Term Expansion = Yes",
+        "CAPEX ≥10 MUSD = Yes",
+    ])
 
     # 🔹 This part splits the companies into two groups:: excluded and retained companies🔹
-    exc = df[df["Excluded"]].copy()
-    ret = df[~df["Excluded"]].copy()
-    return exc[[
-        "Company",
-        "Resources under Development and Field Evaluation",
-        "Exploration CAPEX 3-year average",
-        "Short-Term Expansion ≥20 mmboe",
-        "Exploration CAPEX ≥10 MUSD",
-        "Exclusion Reason"
-    ]], ret[[
+    # 🔹 The rows and the report columns are taken in the same step, so each group is copied once 🔹
+    out_cols = [
         "Company",
         "Resources under Development and Field Evaluation",
         "Exploration CAPEX 3-year average",
         "Short-Term Expansion ≥20 mmboe",
         "Exploration CAPEX ≥10 MUSD",
         "Exclusion Reason"
-    ]]
+    ]
+    col_pos = df.columns.get_indexer(out_cols)
+    return (
+        df.iloc[np.flatnonzero(is_excl), col_pos],
+        df.iloc[np.flatnonzero(np.invert(is_excl)), col_pos],
+    )
 
 # 🔹 Excel Helpers 🔹
+# 🔹 Writes one table to a new sheet, row by row: header first, then each company. constant_memory mode needs exactly this order (it only keeps the current row), which is why pandas' to_excel (column by column) is not used. Empty cells (NaN) are written as blank cells, and infinite numbers (e.g. a cell that said "inf") as the text "inf"/"-inf", like pandas' to_excel does, since Excel has no number for them. 🔹
+def write_sheet(wb, name, df, cols, header_fmt):
+    ws = wb.add_worksheet(name)
+    ws.write_row(0, 0, cols, header_fmt)
+    # 🔹 Only the columns the table actually has are written; columns it lacks are simply left blank. Neighbouring columns form one run (sheet column, first and last position in "present"), so each run is one write_row call. 🔹
+    present, runs = [], []
+    for j, col in enumerate(cols):
+        if col not in df.columns:
+            continue
+        if runs and runs[-1][0] + runs[-1][2] - runs[-1][1] == j:
+            runs[-1][2] += 1
+        else:
+            runs.append([j, len(present), len(present) + 1])
+        present.append(col)
+    # 🔹 The table is turned into plain Python values once (one array for the whole sheet, blanks as None, infinite numbers as text) and then handed out row by row 🔹
+    table = df[present]
+    data = table.to_numpy(dtype=object)
+    data[pd.isna(data)] = None
+    for j in range(len(present)):
+        values = table.iloc[:, j]
+        if pd.api.types.is_float_dtype(values):
+            values = values.to_numpy()
+            data[values == np.inf, j] = "inf"
+            data[values == -np.inf, j] = "-inf"
+    for i, row in enumerate(data.tolist(), start=1):
+        for start, lo, hi in runs:
+            ws.write_row(i, start, row[lo:hi])
+
+# 🔹 Opens an in-memory Excel workbook with the report settings and the same bold, boxed header look pandas uses 🔹
+def new_workbook(buf):
+    wb = xlsxwriter.Workbook(buf, XLSX_OPTIONS)
+    header_fmt = wb.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    return wb, header_fmt
+
 # 🔹 This function prepares and exports the Level 1 results into an Excel file with 3 separate sheets: Excluded Level 1, Retained Level 1, L1 No Data 🔹
 def to_excel_l1(exc, ret, no_data):
     cols = [
@@ -270,10 +379,11 @@ def to_excel_l1(exc, ret, no_data):
     ret     = remove_equity_from_bb_ticker(ret)
     no_data = remove_equity_from_bb_ticker(no_data)
     buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
-        exc.reindex(columns=cols).to_excel(w, "Excluded Level 1", index=False)
-        ret.reindex(columns=cols).to_excel(w, "Retained Level 1", index=False)
-        no_data.reindex(columns=cols).to_excel(w, "L1 No Data", index=False)
+    wb, header_fmt = new_workbook(buf)
+    write_sheet(wb, "Excluded Level 1", exc,     cols, header_fmt)
+    write_sheet(wb, "Retained Level 1", ret,     cols, header_fmt)
+    write_sheet(wb, "L1 No Data",       no_data, cols, header_fmt)
+    wb.close()
     buf.seek(0)
     return buf
 
@@ -299,18 +409,19 @@ def to_excel_l2(all_exc, exc1, exc2, ret1, ret2, exc_up, ret_up):
     # 🔹 Remove duplicates while preserving order 🔹
     cols = list(dict.fromkeys(cols))
     for df in (all_exc, exc1, exc2, ret1, ret2, exc_up, ret_up):
-        df.update(remove_equity_from_bb_ticker(df))
+        remove_equity_from_bb_ticker(df, inplace=True)
     
     # 🔹 This creates a temporary "file" in memory. It acts like a blank Excel file, but it's stored in RAM (not saved on your computer yet). 🔹
     buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
-        all_exc.reindex(columns=cols).to_excel(w, "All Excluded Companies", index=False)
-        exc1   .reindex(columns=cols).to_excel(w, "Excluded Level 1",      index=False)
-        exc2   .reindex(columns=cols).to_excel(w, "Midstream Excluded",     index=False)
-        ret1   .reindex(columns=cols).to_excel(w, "Retained Level 1",       index=False)
-        ret2   .reindex(columns=cols).to_excel(w, "Midstream Retained",     index=False)
-        exc_up .reindex(columns=cols).to_excel(w, "Upstream Excluded",      index=False)
-        ret_up .reindex(columns=cols).to_excel(w, "Upstream Retained",      index=False)
+    wb, header_fmt = new_workbook(buf)
+    write_sheet(wb, "All Excluded Companies", all_exc, cols, header_fmt)
+    write_sheet(wb, "Excluded Level 1",       exc1,    cols, header_fmt)
+    write_sheet(wb, "Midstream Excluded",     exc2,    cols, header_fmt)
+    write_sheet(wb, "Retained Level 1",       ret1,    cols, header_fmt)
+    write_sheet(wb, "Midstream Retained",     ret2,    cols, header_fmt)
+    write_sheet(wb, "Upstream Excluded",      exc_up,  cols, header_fmt)
+    write_sheet(wb, "Upstream Retained",      ret_up,  cols, header_fmt)
+    wb.close()
     buf.seek(0)
     return buf
 
@@ -350,7 +461,7 @@ def main():
         if not uploaded:
             st.warning("Please upload a file first.")
         else:
-            exc1, ret1, no1 = filter_companies_by_revenue(uploaded, sector_excs, total_thresholds)
+            exc1, ret1, no1 = filter_companies_by_revenue(uploaded.getvalue(), sector_excs, total_thresholds)
             st.success("Level 1 complete")
             st.download_button(
                 "Download Level 1 Results",
@@ -365,38 +476,28 @@ def main():
     
     # 🔹 When the user clicks “Run Level 2 Exclusion”. It collects all excluded companies, lists why they were excluded, and gives the user a downloadable Excel report.🔹
     if st.button("Run Level 2 Exclusion"):
-        df_all = pd.read_excel(uploaded, "All Companies", header=[3, 4])
-        df_all = ensure_unique_columns(df_all)      #  <-- after reading
-        exc_all, ret_all = filter_all_companies(df_all)
-       # 🔹 Upstream L2
-        df_up = pd.read_excel(uploaded, "Upstream", header=[3, 4])
-        df_up = ensure_unique_columns(df_up)        #  <-- after reading
-        exc_up, ret_up = filter_upstream_companies(df_up)
         if not uploaded:
             st.warning("Please upload a file first.")
             return
 
-        # 🔹 This code runs the Level 1 filtering using the file and settings the user chose. It then combines all the results (excluded, retained, and no-data) into one clean table, making sure the columns are neat and non-duplicated 🔹 
-        exc1, ret1, no1 = filter_companies_by_revenue(uploaded, sector_excs, total_thresholds)
-        df_l1_all = pd.concat([exc1, ret1, no1], ignore_index=True)
-        df_l1_all = ensure_unique_columns(df_l1_all)
-
-        # 🔹 This makes sure that both the “All Companies” sheet and the “Upstream” sheet have no repeated columns, so that the next steps in Level 2 filtering can run safely and correctly. 🔹
-        df_all = ensure_unique_columns(df_all)
-        df_up  = ensure_unique_columns(df_up)
-
-        # 🔹 This makes sure that both the midstream and upstream exclusion results are clean and have no repeated column names before we combine or export them. 🔹
-        exc_all = ensure_unique_columns(exc_all)
-        exc_up  = ensure_unique_columns(exc_up)
+        # 🔹 Each sheet is parsed once per uploaded file; "load_sheet" keeps the result between Streamlit reruns. 🔹
+        file_bytes = uploaded.getvalue()
 
         # 🔹 This reads the All Companies sheet from the uploaded Excel file, and checks whether companies are expanding their pipeline or gas infrastructure. Based on this, it splits the companies into two groups: ❌ excluded and ✅ retained. 🔹
-        df_all = pd.read_excel(uploaded, "All Companies", header=[3,4])
+        df_all = load_sheet(file_bytes, "All Companies")
+        df_all = ensure_unique_columns(df_all)      #  <-- after reading
         exc_all, ret_all = filter_all_companies(df_all)
 
         # 🔹 This reads the Upstream sheet and filters out companies that are actively investing in new oil/gas exploration or development. It splits the companies into ❌ excluded and ✅ retained based on these checks. 🔹
-        df_up = pd.read_excel(uploaded, "Upstream", header=[3,4])
+        df_up = load_sheet(file_bytes, "Upstream")
+        df_up = ensure_unique_columns(df_up)        #  <-- after reading
         exc_up, ret_up = filter_upstream_companies(df_up)
 
+        # 🔹 This code runs the Level 1 filtering using the file and settings the user chose. It then combines all the results (excluded, retained, and no-data) into one clean table, making sure the columns are neat and non-duplicated 🔹 
+        exc1, ret1, no1 = filter_companies_by_revenue(file_bytes, sector_excs, total_thresholds)
+        df_l1_all = pd.concat([exc1, ret1, no1], ignore_index=True)
+        df_l1_all = ensure_unique_columns(df_l1_all)
+
         # 🔹 This builds a combined list of all excluded companies, no matter whether they were filtered out in Level 1, midstream, or upstream. It makes sure each company only appears once, even if it was excluded in more than one way. 🔹
         union = pd.concat([
             exc1[["Company"]],
@@ -420,10 +521,10 @@ def main():
         )
 
         # 🔹 This creates one final column that combines all the exclusion reasons (Level 1, midstream, and upstream) into one clear sentence per company.🔹
+        reasons = union[["L1_Reason","L2_Reason_AC","L2_Reason_UP"]].fillna("")
         union["Exclusion Reason"] = (
-            union[["L1_Reason","L2_Reason_AC","L2_Reason_UP"]]
-              .fillna("")
-              .agg("; ".join, axis=1)
+            reasons["L1_Reason"]
+              .str.cat([reasons["L2_Reason_AC"], reasons["L2_Reason_UP"]], sep="; ")
               .str.replace(r"(; )+", "; ")
               .str.strip("; ")
         )
@@ -446,9 +547,8 @@ def main():
         union = union.drop(columns=[c for c in union.columns if c.endswith("_y")])
 
         # 🔹 These lines build the list of companies that passed all filters — they weren't excluded by revenue, pipelines, or upstream activity — and brings back all their details for reporting. 🔹
-        all_names = set(df_l1_all["Company"])
-        exc2_names = set(union["Company"])
-        ret2 = pd.DataFrame({"Company":[c for c in all_names if c not in exc2_names]})
+        ret_names = pd.Index(df_l1_all["Company"]).difference(union["Company"], sort=False)
+        ret2 = pd.DataFrame({"Company": ret_names})
         ret2 = ret2.merge(df_l1_all, on="Company", how="left")
 
         # 🔹 This step builds the final upstream report tables, with all the details needed for the Excel file — making sure each company has its filtering reason plus all its info like revenue, tickers, and ID numbers🔹 
@@ -498,10 +598,9 @@ def filter_all_companies(df: pd.DataFrame):
     and an ‘Exclusion Reason’ column. 🔹
     """
     # 1. tidy columns ---------------------------------------------------------
-    df = flatten_multilevel_columns(df)
-    df = df.loc[:, ~df.columns.str.lower().str.startswith("parent company")]         
-    df = df.iloc[1:].reset_index(drop=True)          # 🔹 Drops the first data row (df.iloc[1:]), which may contain merged header content or notes from Excel. Resets the index afterward so the rows are renumbered properly. 🔹
-    df = ensure_unique_columns(df)
+    df = flatten_and_drop_parent_columns(df)         
+    df = ensure_unique_columns(df.iloc[1:])          # 🔹 Drops the first data row (df.iloc[1:]), which may contain merged header content or notes from Excel. ensure_unique_columns makes the only copy of the table. 🔹
+    df.index = pd.RangeIndex(len(df))                # 🔹 Renumbers the rows without copying the data again 🔹
 
     # 🔹 2. rename the few columns we care about 🔹
     rename_map = {
@@ -524,28 +623,23 @@ def filter_all_companies(df: pd.DataFrame):
             df[c] = np.nan
 
     # 🔹 4. numeric conversion for the four capacity columns 🔹
-    for c in needed[5:]:
-        df[c] = pd.to_numeric(
-            df[c].astype(str).str.replace(",", "", regex=True),
-            errors="coerce"
-        ).fillna(0)
+    df = clean_numeric_columns(df, needed[5:], COMMA_TABLE)
 
     # 🔹 5. flag & reason. For midstream exclusion 🔹
-    df["Midstream_Flag"] = (
-        (df["Length of Pipelines under Development"] > 0) |
-        (df["Liquefaction Capacity (Export)"]        > 0) |
-        (df["Regasification Capacity (Import)"]      > 0) |
-        (df["Total Capacity under Development"]      > 0)
-    )
-    df["Excluded"] = df["Midstream_Flag"]
+    # 🔹 One comparison over the four capacity columns as a NumPy block; a company is flagged if any of them is above 0 🔹
+    flag = np.logical_or.reduce(df[needed[5:]].to_numpy() > 0, axis=1)
+    df["Midstream_Flag"] = flag
+    df["Excluded"] = flag
     df["Exclusion Reason"] = np.where(
-        df["Midstream_Flag"],
+        flag,
         "Midstream Expansion > 0",
         ""
     )
 
-    excluded = df[df["Excluded"]].copy()
-    retained = df[~df["Excluded"]].copy()
+    # 🔹 Taking rows by position already returns new tables, so no extra .copy() is needed 🔹
+    is_excl = df["Excluded"].to_numpy()
+    excluded = df.iloc[np.flatnonzero(is_excl)]
+    retained = df.iloc[np.flatnonzero(~is_excl)]
     return excluded, retained
 
 